@@ -1,15 +1,22 @@
-from google_auth_oauthlib.flow import Flow
-from google.auth.transport.requests import Request
-from google.auth.exceptions import RefreshError
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from datetime import datetime, timedelta
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
 import base64
 import json
 import os
 import pickle
+import tempfile
+import threading
+import uuid
 import httpx
-from typing import Optional, List, Dict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, List, Dict
+# Google client libraries are imported where they are used: they are heavy and
+# many processes (auth status checks, CLI tools) never reach the Calendar API.
+if TYPE_CHECKING:
+    import httplib2
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import Flow
 try:
     from dotenv import load_dotenv
     load_dotenv()
@@ -17,46 +24,123 @@ except Exception:
     pass
 
 
+@lru_cache(maxsize=1)
+def _get_discovery_doc() -> str:
+    """
+    Calendar v3 discovery document, read once per process from the copy bundled with googleapiclient.
+    Kept as the JSON string: build_from_document mutates a parsed dict, so each build parses its own.
+    """
+    from googleapiclient import discovery_cache
+
+    doc = discovery_cache.get_static_doc('calendar', 'v3')
+    if doc is None:
+        raise Exception("Calendar v3 discovery document not found in googleapiclient.")
+    return doc
+
+
+_WS_STRIP = b' \t\n\r\x0b\x0c'  # whitespace dropped from pasted base64 env values
+
+_thread_local = threading.local()
+# Optional ETag-aware on-disk cache for GETs (off by default). It is unbounded and stores
+# event bodies unencrypted, so only point it at a private directory you prune yourself.
+HTTP_CACHE_DIR = os.getenv('GOOGLE_HTTP_CACHE_DIR', '').strip() or None
+
+
+def _get_thread_http() -> httplib2.Http:
+    """
+    Keep-alive HTTP transport for the current thread.
+    httplib2.Http is not thread-safe, so each worker thread reuses its own connections.
+    """
+    http = getattr(_thread_local, 'http', None)
+    if http is None:
+        import httplib2
+
+        http = httplib2.Http(cache=HTTP_CACHE_DIR, timeout=30)
+        _thread_local.http = http
+    return http
+
+
 class CalendarService:
     SCOPES = ['https://www.googleapis.com/auth/calendar']
+    BATCH_LIMIT = 50  # recommended batch size; the Calendar API accepts up to 1000 calls per batch
+    # Single-flight refresh: concurrent refreshes of the same refresh token share one result.
+    _refresh_lock = threading.Lock()
+    _refreshed_creds: Dict[str, Credentials] = {}
 
     def __init__(self):
         token_file = (os.getenv('GOOGLE_TOKEN_FILE', 'token.pickle') or '').strip()
         self.token_file = token_file or None
         self.credentials_file = os.getenv('GOOGLE_CREDENTIALS_FILE', 'creds.json')
         self.credentials_json_b64 = os.getenv('GOOGLE_CREDENTIALS_JSON_B64')
+        self._client_config_cache = None
+        self._client_config_mtime = None
         self.token_pickle_b64 = os.getenv('GOOGLE_TOKEN_PICKLE_B64')
         self.force_consent = os.getenv('GOOGLE_OAUTH_FORCE_CONSENT', 'false').lower() == 'true'
         self.default_redirect_uri = os.getenv('GOOGLE_REDIRECT_URI')
         self.creds = None
-        self.service = None
+        self._local = threading.local()
         self.latest_token_pickle_b64 = None
+        self._legacy_token_loaded = False
         self._load_credentials()
 
     def _decode_base64_to_bytes(self, value: str) -> bytes:
-        cleaned = value.strip()
-        if (cleaned.startswith('"') and cleaned.endswith('"')) or (
-            cleaned.startswith("'") and cleaned.endswith("'")
+        value = value.strip()
+        if (value.startswith('"') and value.endswith('"')) or (
+            value.startswith("'") and value.endswith("'")
         ):
-            cleaned = cleaned[1:-1]
-        cleaned = "".join(cleaned.split())
-        cleaned = cleaned.replace("-", "+").replace("_", "/")
-        padding = len(cleaned) % 4
-        if padding:
-            cleaned += "=" * (4 - padding)
-        return base64.b64decode(cleaned)
+            value = value[1:-1]
+        cleaned = value.encode('ascii').translate(None, _WS_STRIP)
+        cleaned += b'=' * (-len(cleaned) % 4)
+        # urlsafe_b64decode accepts both the URL-safe and the standard alphabet.
+        return base64.urlsafe_b64decode(cleaned)
+
+    def _credentials_from_token_bytes(self, token_bytes: bytes) -> Optional[Credentials]:
+        """
+        Deserialize a stored token. Tokens are JSON (authorized user info);
+        legacy pickled tokens are still accepted once and flagged for rewrite.
+        """
+        from google.oauth2.credentials import Credentials
+
+        if token_bytes[:1] == b'\x80':
+            # Read-only legacy path; nothing is pickled anymore (see _persist_token).
+            creds = pickle.loads(token_bytes)
+            if isinstance(creds, Credentials):
+                self._legacy_token_loaded = True
+                return creds
+            return None
+
+        info = json.loads(token_bytes)
+        try:
+            oauth = self._get_client_oauth_fields()
+        except Exception:
+            oauth = {}
+        for key in ("client_id", "client_secret", "token_uri"):
+            if not info.get(key) and oauth.get(key):
+                info[key] = oauth[key]
+        if not info.get("refresh_token"):
+            # to_json() omits a missing refresh_token and from_authorized_user_info() requires it;
+            # keep the access token usable until it expires (re-auth is needed after that).
+            expiry = None
+            if info.get("expiry"):
+                expiry = datetime.strptime(info["expiry"].rstrip("Z").split(".")[0], "%Y-%m-%dT%H:%M:%S")
+            return Credentials(
+                token=info.get("token"),
+                token_uri=info.get("token_uri"),
+                client_id=info.get("client_id"),
+                client_secret=info.get("client_secret"),
+                scopes=self.SCOPES,
+                expiry=expiry,
+            )
+        return Credentials.from_authorized_user_info(info, scopes=self.SCOPES)
 
     def _load_token_from_env(self) -> Optional[Credentials]:
         if not self.token_pickle_b64:
             return None
         try:
             token_bytes = self._decode_base64_to_bytes(self.token_pickle_b64)
-            creds = pickle.loads(token_bytes)
-            if isinstance(creds, Credentials):
-                return creds
+            return self._credentials_from_token_bytes(token_bytes)
         except Exception:
             return None
-        return None
 
     def _get_client_oauth_fields(self) -> Dict[str, Optional[str]]:
         """Extract OAuth client fields required for refresh."""
@@ -91,22 +175,18 @@ class CalendarService:
             return None
         try:
             with open(self.token_file, 'rb') as token:
-                creds = pickle.load(token)
-            if isinstance(creds, Credentials):
-                return creds
+                return self._credentials_from_token_bytes(token.read())
         except Exception:
             return None
-        return None
 
     def _serialize_token_to_base64(self) -> Optional[str]:
         if not self.creds:
             return None
         try:
-            token_bytes = pickle.dumps(self.creds)
+            token_bytes = self.creds.to_json().encode('utf-8')
             return base64.b64encode(token_bytes).decode('ascii')
         except Exception:
             return None
-    import httpx
 
     def _update_railway_env(self):
         railway_token = os.getenv("RAILWAY_API_TOKEN")
@@ -147,19 +227,34 @@ class CalendarService:
             pass  # Don't crash the app if this fails
 
     def _persist_token(self):
+        self._legacy_token_loaded = False
         self.latest_token_pickle_b64 = self._serialize_token_to_base64()
         if self.latest_token_pickle_b64:
             self.token_pickle_b64 = self.latest_token_pickle_b64
         if self.creds and self.token_file:
+            # Write to a unique temp file and swap it in so a crash or a concurrent writer never
+            # leaves a torn token.
+            # Best-effort: a missing or read-only token directory must not break auth.
+            tmp_file = None
             try:
-                with open(self.token_file, 'wb') as token:
-                    pickle.dump(self.creds, token)
+                fd, tmp_file = tempfile.mkstemp(
+                    dir=os.path.dirname(self.token_file) or '.',
+                    prefix=os.path.basename(self.token_file) + '.',
+                    suffix='.tmp',
+                )
+                with os.fdopen(fd, 'w', encoding='utf-8') as token:
+                    token.write(self.creds.to_json())
+                    token.flush()
+                    os.fsync(token.fileno())
+                os.replace(tmp_file, self.token_file)
             except Exception:
-                pass
+                if tmp_file:
+                    try:
+                        os.remove(tmp_file)
+                    except OSError:
+                        pass
         self._update_railway_env()
 
-
-
     def get_latest_token_pickle_b64(self) -> Optional[str]:
         if self.latest_token_pickle_b64:
             return self.latest_token_pickle_b64
@@ -169,23 +264,33 @@ class CalendarService:
         return bool(self.token_file)
 
     def _get_client_config(self) -> Dict:
+        """Parsed OAuth client config, cached; a credentials file is re-read only when its mtime changes."""
+        # GOOGLE_CREDENTIALS_JSON_B64 wins outright, so env-only deploys never touch the filesystem.
         if self.credentials_json_b64:
-            try:
-                raw = self._decode_base64_to_bytes(self.credentials_json_b64).decode('utf-8')
-                return json.loads(raw)
-            except Exception:
-                raise Exception("Invalid GOOGLE_CREDENTIALS_JSON_B64")
+            if self._client_config_cache is None:
+                try:
+                    raw = self._decode_base64_to_bytes(self.credentials_json_b64).decode('utf-8')
+                    self._client_config_cache = json.loads(raw)
+                except Exception:
+                    raise Exception("Invalid GOOGLE_CREDENTIALS_JSON_B64")
+            return self._client_config_cache
 
         if self.credentials_file and os.path.exists(self.credentials_file):
-            try:
-                with open(self.credentials_file, 'r', encoding='utf-8') as fh:
-                    return json.load(fh)
-            except Exception:
-                raise Exception(f"Invalid credentials file: {self.credentials_file}")
+            mtime = os.path.getmtime(self.credentials_file)
+            if self._client_config_cache is None or mtime != self._client_config_mtime:
+                try:
+                    with open(self.credentials_file, 'r', encoding='utf-8') as fh:
+                        self._client_config_cache = json.load(fh)
+                    self._client_config_mtime = mtime
+                except Exception:
+                    raise Exception(f"Invalid credentials file: {self.credentials_file}")
+            return self._client_config_cache
 
         raise Exception("Google OAuth client credentials not found. Set GOOGLE_CREDENTIALS_JSON_B64 or GOOGLE_CREDENTIALS_FILE.")
 
     def _build_flow(self, redirect_uri: str) -> Flow:
+        from google_auth_oauthlib.flow import Flow
+
         client_config = self._get_client_config()
         return Flow.from_client_config(
             client_config,
@@ -194,37 +299,78 @@ class CalendarService:
         )
 
     def _load_credentials(self):
-        """Load credentials from env/token file and initialize Calendar service."""
-        self.service = None
-        self.creds = self._load_token_from_env() or self._load_token_from_file()
+        """Load credentials from env/token file; the Calendar service is built lazily."""
+        self._legacy_token_loaded = False
+        # The env token is authoritative when set; the token file is only read without it.
+        if self.token_pickle_b64:
+            self.creds = self._load_token_from_env()
+        else:
+            self.creds = self._load_token_from_file()
         if self.creds:
             self.creds = self._hydrate_credentials_for_refresh(self.creds)
 
         if self.creds and self.creds.expired and self.creds.refresh_token:
+            from google.auth.exceptions import RefreshError
+
             try:
-                self.creds.refresh(Request())
-                self._persist_token()
+                self._refresh_credentials()
             except RefreshError:
                 self.creds = None
-                self.service = None
                 self.token_pickle_b64 = None
                 if self.token_file and os.path.exists(self.token_file):
                     os.remove(self.token_file)
         elif self.creds and self.creds.expired and not self.creds.refresh_token:
             # Expired non-refreshable token should be treated as unauthenticated.
             self.creds = None
-            self.service = None
 
-        if self.creds and self.creds.valid:
-            self.service = build('calendar', 'v3', credentials=self.creds)
+        if self.creds and self._legacy_token_loaded:
+            # One-shot migration of a pickled token to the JSON format.
+            self._persist_token()
+
+    def _refresh_credentials(self):
+        """Refresh expired credentials, reusing another thread's refresh when one already succeeded."""
+        from google.auth.transport.requests import Request
+
+        refresh_token = self.creds.refresh_token
+        with CalendarService._refresh_lock:
+            refreshed = CalendarService._refreshed_creds.get(refresh_token)
+            if refreshed is not None and refreshed.valid:
+                self.creds = refreshed
+                return
+            self.creds.refresh(Request())
+            CalendarService._refreshed_creds[refresh_token] = self.creds
+            self._persist_token()
+
+    def _build_service(self):
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build_from_document
+
+        authed_http = AuthorizedHttp(self.creds, http=_get_thread_http())
+        return build_from_document(_get_discovery_doc(), http=authed_http)
+
+    @property
+    def service(self):
+        """
+        Calendar API resource for the current thread, built on first access while
+        credentials are valid and rebuilt only when the credentials object changes.
+        """
+        if not self._has_valid_credentials():
+            return None
+        if getattr(self._local, 'creds', None) is not self.creds:
+            self._local.service = self._build_service()
+            self._local.creds = self.creds
+        return self._local.service
+
+    def _has_valid_credentials(self) -> bool:
+        return bool(self.creds and self.creds.valid)
 
     def _ensure_authenticated(self) -> bool:
         if self.creds and self.creds.expired:
             self._load_credentials()
-        if self.service is not None:
+        if self._has_valid_credentials():
             return True
         self._load_credentials()
-        return self.service is not None
+        return self._has_valid_credentials()
 
     def _require_service(self):
         if not self._ensure_authenticated():
@@ -262,8 +408,6 @@ class CalendarService:
         
         # Save credentials to file if possible and always keep a base64 form in memory.
         self._persist_token()
-        
-        self.service = build('calendar', 'v3', credentials=self.creds)
     
     def create_event(
         self,
@@ -299,7 +443,7 @@ class CalendarService:
         if add_meet_link:
             event['conferenceData'] = {
                 'createRequest': {
-                    'requestId': f"meet-{start_time.timestamp()}",
+                    'requestId': uuid.uuid4().hex,
                     'conferenceSolutionKey': {'type': 'hangoutsMeet'}
                 }
             }
@@ -313,19 +457,18 @@ class CalendarService:
         
         return created_event
     
-    def create_busy_block(
+    def _busy_block_body(
         self,
         date: datetime,
-        start_hour: int = 9,
-        end_hour: int = 18,
-        summary: str = "Busy",
-        timezone: str = "Asia/Tokyo"
+        start_hour: int,
+        end_hour: int,
+        summary: str,
+        timezone: str
     ) -> Dict:
-        """Create an all-day busy block (e.g., for holidays)."""
         start_time = date.replace(hour=start_hour, minute=0, second=0, microsecond=0)
         end_time = date.replace(hour=end_hour, minute=0, second=0, microsecond=0)
-        
-        event = {
+
+        return {
             'summary': summary,
             'start': {
                 'dateTime': start_time.isoformat(),
@@ -337,13 +480,69 @@ class CalendarService:
             },
             'transparency': 'opaque',  # Shows as busy
         }
-        
-        created_event = self.service.events().insert(
+
+    def _execute_batch(self, requests: List) -> List:
+        """
+        Execute API requests as batch HTTP calls (up to BATCH_LIMIT per call).
+        Results keep the input order; the first failed sub-request is raised.
+        """
+        service = self._require_service()
+        results = [None] * len(requests)
+        errors = []
+
+        def collect(request_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+            else:
+                results[int(request_id)] = response
+
+        for offset in range(0, len(requests), self.BATCH_LIMIT):
+            batch = service.new_batch_http_request(callback=collect)
+            for index, request in enumerate(requests[offset:offset + self.BATCH_LIMIT], start=offset):
+                batch.add(request, request_id=str(index))
+            batch.execute()
+
+        if errors:
+            raise errors[0]
+        return results
+
+    def create_busy_block(
+        self,
+        date: datetime,
+        start_hour: int = 9,
+        end_hour: int = 18,
+        summary: str = "Busy",
+        timezone: str = "Asia/Tokyo"
+    ) -> Dict:
+        """Create an all-day busy block (e.g., for holidays)."""
+        service = self._require_service()
+        event = self._busy_block_body(date, start_hour, end_hour, summary, timezone)
+
+        created_event = service.events().insert(
             calendarId='primary',
             body=event
         ).execute()
         
         return created_event
+
+    def create_busy_blocks(
+        self,
+        dates: List[datetime],
+        start_hour: int = 9,
+        end_hour: int = 18,
+        summary: str = "Busy",
+        timezone: str = "Asia/Tokyo"
+    ) -> List[Dict]:
+        """Create busy blocks for several dates using batched requests."""
+        service = self._require_service()
+        requests = [
+            service.events().insert(
+                calendarId='primary',
+                body=self._busy_block_body(date, start_hour, end_hour, summary, timezone)
+            )
+            for date in dates
+        ]
+        return self._execute_batch(requests)
     
     def get_events(
         self,
@@ -364,6 +563,17 @@ class CalendarService:
         
         return events_result.get('items', [])
 
+    def freebusy_query(self, start_time: str, end_time: str) -> List[Dict]:
+        """Get busy intervals ({'start', 'end'}) on the primary calendar in a time range."""
+        service = self._require_service()
+        result = service.freebusy().query(body={
+            'timeMin': start_time,
+            'timeMax': end_time,
+            'items': [{'id': 'primary'}],
+        }).execute()
+
+        return result.get('calendars', {}).get('primary', {}).get('busy', [])
+
     def get_event(self, event_id: str) -> Dict:
         """Get a single event by id."""
         service = self._require_service()
@@ -383,14 +593,16 @@ class CalendarService:
             time_min = (start_time - timedelta(hours=1)).isoformat() + 'Z'
             time_max = (start_time + timedelta(hours=1)).isoformat() + 'Z'
         else:
-            time_min = datetime.now().isoformat() + 'Z'
-            time_max = (datetime.now() + timedelta(days=30)).isoformat() + 'Z'
+            now = datetime.now(timezone.utc)
+            time_min = now.isoformat()
+            time_max = (now + timedelta(days=30)).isoformat()
         
         events = self.get_events(time_min, time_max)
         
         # Filter by summary if provided
         if summary:
-            events = [e for e in events if summary.lower() in e.get('summary', '').lower()]
+            needle = summary.casefold()
+            events = [e for e in events if needle in (e.get('summary') or '').casefold()]
         
         return events
     
@@ -403,42 +615,41 @@ class CalendarService:
         description: Optional[str] = None,
         timezone: str = "Asia/Tokyo"
     ) -> Dict:
-        """Update an existing event."""
+        """Update an existing event, sending only the changed fields."""
         service = self._require_service()
-        # Get existing event
-        event = service.events().get(
-            calendarId='primary',
-            eventId=event_id
-        ).execute()
+        patch_body = {}
 
-        # Update fields
         if summary:
-            event['summary'] = summary
+            patch_body['summary'] = summary
         if description is not None:
-            event['description'] = description
+            patch_body['description'] = description
         if start_time:
             if duration_minutes:
                 end_time = start_time + timedelta(minutes=duration_minutes)
             else:
-                # Keep same duration
+                # Keep same duration; only this case needs the existing event
+                event = service.events().get(
+                    calendarId='primary',
+                    eventId=event_id
+                ).execute()
                 old_start = datetime.fromisoformat(event['start']['dateTime'].replace('Z', '+00:00'))
                 old_end = datetime.fromisoformat(event['end']['dateTime'].replace('Z', '+00:00'))
                 duration = old_end - old_start
                 end_time = start_time + duration
             
-            event['start'] = {
+            patch_body['start'] = {
                 'dateTime': start_time.isoformat(),
                 'timeZone': timezone,
             }
-            event['end'] = {
+            patch_body['end'] = {
                 'dateTime': end_time.isoformat(),
                 'timeZone': timezone,
             }
 
-        updated_event = service.events().update(
+        updated_event = service.events().patch(
             calendarId='primary',
             eventId=event_id,
-            body=event
+            body=patch_body
         ).execute()
 
         return updated_event
@@ -450,3 +661,17 @@ class CalendarService:
             calendarId='primary',
             eventId=event_id
         ).execute()
+
+    def delete_events(self, event_ids: List[str]):
+        """Delete several events using batched requests."""
+        service = self._require_service()
+        self._execute_batch([
+            service.events().delete(calendarId='primary', eventId=event_id)
+            for event_id in event_ids
+        ])
+
+
+@lru_cache(maxsize=1)
+def get_calendar_service() -> CalendarService:
+    """Return the process-wide CalendarService; it refreshes and persists its own token."""
+    return CalendarService()
@@ -0,0 +1,4 @@
+from calendar_service import get_calendar_service
+
+# The one CalendarService shared by the API handlers and utils helpers.
+calendar_service = get_calendar_service()
@@ -1,9 +1,58 @@
 
 from datetime import datetime
+import asyncio
+import logging
 import os
 import smtplib
+import threading
+import time
 from email.message import EmailMessage
 
+logger = logging.getLogger(__name__)
+
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+
+# Authenticated SMTP sessions reused across notification batches, keyed by (host, port, username).
+_smtp_pool: dict = {}
+_smtp_pool_lock = threading.Lock()
+
+
+def _close_smtp(server: smtplib.SMTP):
+    try:
+        server.quit()
+    except Exception:
+        server.close()
+
+
+def _acquire_smtp(host: str, port: int, username: str | None, password: str | None, use_tls: bool) -> smtplib.SMTP:
+    """
+    Return a live pooled session, or open and authenticate a new one.
+    Sessions idle longer than SMTP_IDLE_TIMEOUT or failing NOOP are discarded.
+    Caller must hold _smtp_pool_lock.
+    """
+    entry = _smtp_pool.pop((host, port, username), None)
+    if entry is not None:
+        server, last_used = entry
+        if time.monotonic() - last_used <= SMTP_IDLE_TIMEOUT:
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except (smtplib.SMTPException, OSError):
+                pass
+        _close_smtp(server)
+
+    server = smtplib.SMTP(host, port, timeout=20)
+    try:
+        if use_tls:
+            server.starttls()
+        if username and password:
+            server.login(username, password)
+    except Exception:
+        _close_smtp(server)
+        raise
+    return server
+
+
 def send_meeting_notifications(event: dict, start_time: datetime, duration: int, topic: str):
     """
     Send notification emails to host and attendees for a scheduled meeting.
@@ -45,20 +94,32 @@ def send_meeting_notifications(event: dict, start_time: datetime, duration: int,
         f"Meet link: {meet_link}\n"
     )
 
+    # One message and one DATA transaction for everyone; recipients only travel in the
+    # envelope so attendees still don't see each other's addresses.
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = smtp_from
+    msg["To"] = "undisclosed-recipients:;"
+    msg.set_content(body)
+
     try:
-        with smtplib.SMTP(smtp_host, smtp_port, timeout=20) as server:
-            if smtp_use_tls:
-                server.starttls()
-            if smtp_username and smtp_password:
-                server.login(smtp_username, smtp_password)
-
-            for recipient in recipients:
-                msg = EmailMessage()
-                msg["Subject"] = subject
-                msg["From"] = smtp_from
-                msg["To"] = recipient
-                msg.set_content(body)
-                server.send_message(msg)
-    except Exception as exc:
-        print(f"Notification email send failed: {exc}")
+        with _smtp_pool_lock:
+            server = _acquire_smtp(smtp_host, smtp_port, smtp_username, smtp_password, smtp_use_tls)
+            try:
+                server.send_message(msg, from_addr=smtp_from, to_addrs=sorted(recipients))
+            except Exception:
+                _close_smtp(server)
+                raise
+            _smtp_pool[(smtp_host, smtp_port, smtp_username)] = (server, time.monotonic())
+    except Exception:
+        # Runs as a background task, so failures must be logged rather than raised.
+        logger.exception("Notification email send failed")
+
+
+async def send_meeting_notifications_async(event: dict, start_time: datetime, duration: int, topic: str):
+    """
+    Async variant for callers on the event loop.
+    The blocking SMTP conversation runs in a worker thread.
+    """
+    await asyncio.to_thread(send_meeting_notifications, event, start_time, duration, topic)
 
@@ -1,14 +1,15 @@
+import asyncio
 import os
 from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from datetime import datetime, time, timedelta, timezone
 from fastapi.responses import FileResponse
-from calendar_service import CalendarService
+from calendar_service_singleton import calendar_service
 from nlp_parser import MeetingParser
 from fastapi.staticfiles import StaticFiles
 from invite_email import send_meeting_notifications
-from utils import has_overlapping_event, _parse_google_datetime,is_japanese_working_hours
+from utils import has_overlapping_event, _parse_google_datetime,is_japanese_working_hours, clear_busy_cache
 
 try:
     from dotenv import load_dotenv
@@ -45,7 +46,6 @@ app.add_middleware(
 )
 
 # Initialize services
-calendar_service = CalendarService()
 meeting_parser = MeetingParser()
 
 
@@ -72,14 +72,13 @@ def cancellation_response(status: str, reason: str):
 def apply_hardcoded_fallback_rules(meeting_details: dict) -> dict:
     """
     Deterministic fallback when AI parsing/decision is unavailable or unusable.
+    Sets status/reason on meeting_details in place and returns it.
     """
     start_time = meeting_details.get("start_time")
     if not isinstance(start_time, datetime):
-        return {
-            **meeting_details,
-            "status": "incomplete",
-            "reason": "Date/time not specified.",
-        }
+        meeting_details["status"] = "incomplete"
+        meeting_details["reason"] = "Date/time not specified."
+        return meeting_details
 
     attendees = meeting_details.get("attendees", [])
     if not isinstance(attendees, list):
@@ -87,31 +86,24 @@ def apply_hardcoded_fallback_rules(meeting_details: dict) -> dict:
         meeting_details["attendees"] = attendees
 
     if len(attendees) == 0:
-        return {
-            **meeting_details,
-            "status": "no_attendees",
-            "reason": "No attendees specified",
-        }
+        meeting_details["status"] = "no_attendees"
+        meeting_details["reason"] = "No attendees specified"
+        return meeting_details
 
-    if start_time < datetime.now() or (start_time - datetime.now()).total_seconds() < 18000:
-        return {
-            **meeting_details,
-            "status": "too_soon",
-            "reason": "Meeting is too soon (less than 5 hours from now)",
-        }
+    now = datetime.now()
+    if start_time < now or (start_time - now).total_seconds() < 18000:
+        meeting_details["status"] = "too_soon"
+        meeting_details["reason"] = "Meeting is too soon (less than 5 hours from now)"
+        return meeting_details
 
     if is_japanese_working_hours(start_time):
-        return {
-            **meeting_details,
-            "status": "not_working_hours",
-            "reason": "JST working hours (9am-7pm on working days)",
-        }
+        meeting_details["status"] = "not_working_hours"
+        meeting_details["reason"] = "JST working hours (9am-7pm on working days)"
+        return meeting_details
 
-    return {
-        **meeting_details,
-        "status": "valid",
-        "reason": "none",
-    }
+    meeting_details["status"] = "valid"
+    meeting_details["reason"] = "none"
+    return meeting_details
 
 
 def is_ai_decision_usable(meeting_details: dict) -> bool:
@@ -138,6 +130,14 @@ async def root():
     return {"message": "Calendar Automation API is running"}
 
 
+def warm_calendar_credentials():
+    """Best-effort credential refresh; real failures surface on the calendar calls themselves."""
+    try:
+        calendar_service.is_authenticated()
+    except Exception:
+        pass
+
+
 def resolve_redirect_uri(request: Request) -> str:
     configured = os.getenv("GOOGLE_REDIRECT_URI")
     if configured:
@@ -154,8 +154,12 @@ async def schedule_meeting(text_command: TextCommand, background_tasks: Backgrou
     Example: "schedule a meet at 3pm next sunday, topic is interview with alex"
     """
     try:
-        # Parse the natural language command
-        meeting_details = await meeting_parser.parse(text_command.command, text_command.history)
+        # Parse the natural language command while Google credentials are warmed
+        # (an expired token is refreshed during the Groq round trip, not after it).
+        meeting_details, _ = await asyncio.gather(
+            meeting_parser.parse(text_command.command, text_command.history),
+            asyncio.to_thread(warm_calendar_credentials),
+        )
         if not is_ai_decision_usable(meeting_details):
             meeting_details = apply_hardcoded_fallback_rules(meeting_details)
 
@@ -168,10 +172,11 @@ async def schedule_meeting(text_command: TextCommand, background_tasks: Backgrou
         # Otherwise, actually schedule the meeting with Google Meet
         start_time = meeting_details["start_time"]
         duration_minutes = meeting_details.get("duration", 30)
-        if has_overlapping_event(start_time, duration_minutes):
+        if await asyncio.to_thread(has_overlapping_event, start_time, duration_minutes):
             return cancellation_response("conflict", "Meeting overlaps with an existing calendar event")
 
-        event = calendar_service.create_event(
+        event = await asyncio.to_thread(
+            calendar_service.create_event,
             summary=meeting_details["topic"],
             start_time=start_time,
             duration_minutes=duration_minutes,
@@ -179,6 +184,7 @@ async def schedule_meeting(text_command: TextCommand, background_tasks: Backgrou
             attendees=meeting_details.get("attendees", []),
             add_meet_link=True  # Add Google Meet link
         )
+        clear_busy_cache()
 
         background_tasks.add_task(
             send_meeting_notifications,
@@ -216,7 +222,7 @@ async def update_event(event_id: str, payload: UpdateEventRequest):
             raise HTTPException(status_code=400, detail="No update fields provided.")
 
         if payload.start_time is not None or payload.duration_minutes is not None:
-            existing_event = calendar_service.get_event(event_id)
+            existing_event = await asyncio.to_thread(calendar_service.get_event, event_id)
             existing_start = _parse_google_datetime(existing_event.get("start", {}).get("dateTime"))
             existing_end = _parse_google_datetime(existing_event.get("end", {}).get("dateTime"))
             if not existing_start or not existing_end:
@@ -228,19 +234,24 @@ async def update_event(event_id: str, payload: UpdateEventRequest):
             else:
                 target_duration = int((existing_end - existing_start).total_seconds() // 60)
 
-            if has_overlapping_event(target_start, target_duration, exclude_event_id=event_id):
+            if await asyncio.to_thread(
+                has_overlapping_event, target_start, target_duration, exclude_event_id=event_id
+            ):
                 raise HTTPException(
                     status_code=409,
                     detail="Updated time overlaps with an existing calendar event."
                 )
 
-        updated = calendar_service.update_event(
+        updated = await asyncio.to_thread(
+            calendar_service.update_event,
             event_id=event_id,
             summary=payload.summary,
             start_time=payload.start_time,
-            duration_minutes=payload.duration_minutes,
+            # The duration is already resolved above, so update_event needn't re-GET the event.
+            duration_minutes=target_duration if payload.start_time is not None else payload.duration_minutes,
             description=payload.description
         )
+        clear_busy_cache()
 
         return {
             "status": "updated",
@@ -262,7 +273,8 @@ async def delete_event(event_id: str):
     Delete an existing calendar event by event_id.
     """
     try:
-        calendar_service.delete_event(event_id)
+        await asyncio.to_thread(calendar_service.delete_event, event_id)
+        clear_busy_cache()
         return {"status": "deleted", "event_id": event_id}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -288,7 +300,7 @@ async def google_auth_callback(request: Request, code: str):
     Handles OAuth callback from Google.
     """
     try:
-        calendar_service.handle_auth_callback(code, resolve_redirect_uri(request))
+        await asyncio.to_thread(calendar_service.handle_auth_callback, code, resolve_redirect_uri(request))
         response = {"status": "success", "message": "Authentication successful"}
         return_token_b64 = os.getenv("RETURN_TOKEN_B64_IN_CALLBACK", "false").lower() == "true"
         if return_token_b64 or not calendar_service.uses_file_token_storage():
@@ -300,4 +312,4 @@ async def google_auth_callback(request: Request, code: str):
 
 @app.get("/auth/status")
 async def auth_status():
-    return {"authenticated": calendar_service.is_authenticated()}
+    return {"authenticated": await asyncio.to_thread(calendar_service.is_authenticated)}
@@ -1,34 +1,30 @@
-from groq import Groq
+from groq import AsyncGroq
+import httpx
+from cachetools import TTLCache
+import ciso8601
 from datetime import datetime, time, timezone, timedelta
-import json
+import hashlib
+import logging
+import orjson
 import os
 import re
 from typing import Dict, Optional, List
-import jpholiday
 import zoneinfo
+from utils import _is_jp_holiday
 
-JST = zoneinfo.ZoneInfo("Asia/Tokyo")
-
-
-def now_jst() -> datetime:
-    """Always returns current time in JST, regardless of server timezone."""
-    return datetime.now(tz=JST)
-
+logger = logging.getLogger(__name__)
 
-class MeetingParser:
-    def __init__(self):
-        self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-        self.model = os.getenv("PARSER_MODEL", "llama-3.3-70b-versatile")
+JST = zoneinfo.ZoneInfo("Asia/Tokyo")
+# Raw LLM replies are reused for identical normalized commands within the same JST hour.
+PARSER_CACHE_TTL = int(os.getenv("PARSER_CACHE_TTL", "600"))
 
-    # =========================
-    # MAIN PARSE
-    # =========================
-    async def parse(self, command: str, history: Optional[List[str]] = None) -> Dict:
-        history_text = "\n".join(history) if history else "None"
-        now = now_jst()
-        now_text = now.strftime("%Y-%m-%d %H:%M:%S")
+_FENCE_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)```")
+_BRACE_RE = re.compile(r"\{[\s\S]*\}")
+_DT_RE = re.compile(r"(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}(?::\d{2})?)")
+_EMAIL_RE = re.compile(r"^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$")
 
-        system_prompt = f"""You are an AI meeting scheduler that converts natural language into a structured meeting object.
+# Static prompt text is built once; only {now} and {history} are filled in per request.
+_PARSE_SYSTEM_PROMPT = """You are an AI meeting scheduler that converts natural language into a structured meeting object.
 
 Rules:
 1. Resolve ALL relative time expressions into absolute JST datetimes.
@@ -45,10 +41,10 @@ Rules:
 
 Return STRICT JSON ONLY — no markdown, no explanation, no extra keys:
 
-Current datetime (JST / Asia/Tokyo): {now_text}
+Current datetime (JST / Asia/Tokyo): {now}
 
 Conversation history:
-{history_text}
+{history}
 
 ---
 Expected output format (JSON only):
@@ -69,33 +65,101 @@ Example output (assuming today is 2025-01-27 Monday):
   "attendees": ["john@example.com", "sarah@company.com"],
   "description": "Q2 planning session"
 }}"""
+
+_UPDATE_SYSTEM_PROMPT = """You are parsing a meeting update command.
+
+Current datetime (JST / Asia/Tokyo): {now}
+
+Extract ONLY the fields that should be updated. Resolve any relative time expressions (e.g. "tomorrow 3pm", "next Monday 10am") into absolute JST datetimes.
+
+Return STRICT JSON ONLY — no markdown, no extra keys. Include only the fields that are changing:
+
+{{
+  "topic": "new title",
+  "start_time": "YYYY-MM-DD HH:MM:SS",
+  "duration": 60,
+  "description": "new description"
+}}"""
+
+
+def now_jst() -> datetime:
+    """Always returns current time in JST, regardless of server timezone."""
+    return datetime.now(tz=JST)
+
+
+def _format_prompt_datetime(dt: datetime) -> str:
+    """YYYY-MM-DD HH:MM:SS without going through strftime's locale machinery."""
+    return f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d} {dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}"
+
+
+class MeetingParser:
+    def __init__(self):
+        # Long-lived HTTP/2 client so Groq calls reuse one TLS connection instead of reconnecting.
+        self._http = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+            timeout=30,
+        )
+        self.client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), http_client=self._http)
+        self.model = os.getenv("PARSER_MODEL", "llama-3.3-70b-versatile")
+        self._response_cache = TTLCache(maxsize=1024, ttl=PARSER_CACHE_TTL)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _cache_key(self, command: str, history: Optional[List[str]], now: datetime) -> str:
+        normalized_command = " ".join(command.lower().split())
+        normalized_history = "\n".join(" ".join(h.lower().split()) for h in history) if history else ""
+        payload = "\x1f".join((self.model, normalized_command, normalized_history, now.strftime("%Y-%m-%d %H")))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # =========================
+    # MAIN PARSE
+    # =========================
+    async def parse(self, command: str, history: Optional[List[str]] = None, now: Optional[datetime] = None) -> Dict:
+        history_text = "\n".join(history) if history else "None"
+        # One "now" for the prompt and for validation, so both resolve relative times identically.
+        now = now or now_jst()
+        now_text = _format_prompt_datetime(now)
+
+        system_prompt = _PARSE_SYSTEM_PROMPT.format_map({"now": now_text, "history": history_text})
         
 
         try:
-            completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": command},
-                ],
-                temperature=0.1,
-                max_tokens=400,
-            )
-
+            # Cache the raw reply (pre-_finalize) so status rules still run against the current time.
+            cache_key = self._cache_key(command, history, now)
+            raw = self._response_cache.get(cache_key)
+            cache_hit = raw is not None
+            if cache_hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+                completion = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": command},
+                    ],
+                    temperature=0.1,
+                    max_tokens=280,
+                    response_format={"type": "json_object"},
+                )
+                raw = completion.choices[0].message.content
 
-            raw = completion.choices[0].message.content
             parsed = self._load_json(raw)
-            #print(raw)
-            return self._finalize(parsed, command)
-
-        except Exception as e:
-            print("AI parse failed:", e)
+            if not cache_hit:
+                # Store only fresh replies; re-storing a hit would push its TTL expiry back.
+                self._response_cache[cache_key] = raw
+            logger.debug("groq raw=%s", raw)
+            return self._finalize(parsed, command, now)
+
+        except Exception:
+            logger.exception("AI parse failed")
             return self._empty("ai_error")
 
     # =========================
     # FINALIZE + VALIDATION
     # =========================
-    def _finalize(self, data: Dict, command: str) -> Dict:
+    def _finalize(self, data: Dict, command: str, now: Optional[datetime] = None) -> Dict:
         topic = (data.get("topic") or "AI Scheduler Meeting").strip()
         duration = self._safe_int(data.get("duration"), 30)
         description = (data.get("description") or command).strip()
@@ -113,8 +177,8 @@ Example output (assuming today is 2025-01-27 Monday):
             attendees.append(test_email)
         #print(attendees, len(attendees))
 
-        status, reason = self._derive_status(start_dt, attendees)
-        print(f"Derived status: {status} \n (reason: {reason}) for command: '{command}' with parsed data: {data}")
+        status, reason = self._derive_status(start_dt, attendees, now)
+        logger.debug("Derived status: %s (reason: %s) for command: %r with parsed data: %s", status, reason, command, data)
         return {
             "status": status,
             "reason": reason,
@@ -129,7 +193,7 @@ Example output (assuming today is 2025-01-27 Monday):
     # =========================
     # STATUS RULES
     # =========================
-    def _derive_status(self, start_dt: Optional[datetime], attendees: List[str]):
+    def _derive_status(self, start_dt: Optional[datetime], attendees: List[str], now: Optional[datetime] = None):
         # Order matters — check in priority sequence
         if not start_dt:
             return "incomplete", "Date/time missing."
@@ -137,7 +201,7 @@ Example output (assuming today is 2025-01-27 Monday):
         if not attendees or len(attendees) <= 1:
             return "no_attendees", "No attendee emails."
 
-        now = now_jst()
+        now = now or now_jst()
 
         # Make start_dt timezone-aware for comparison if it isn't already
         if start_dt.tzinfo is None:
@@ -146,10 +210,14 @@ Example output (assuming today is 2025-01-27 Monday):
         if start_dt <= now or (start_dt - now).total_seconds() < 18000:
             return "too_soon", "Meeting is less than 5 hours away."
 
-        is_weekday = start_dt.weekday() < 5  # Mon=0 … Fri=4
-        in_working_hours = time(9, 0) <= start_dt.time() < time(19, 0)
+        # Cheapest first: weekday and time-of-day before the holiday lookup.
+        if start_dt.weekday() >= 5:  # Sat/Sun
+            return "valid", "ok"
+
+        if not (time(9, 0) <= start_dt.time() < time(19, 0)):
+            return "valid", "ok"
 
-        if is_weekday and in_working_hours and not jpholiday.is_holiday(start_dt.date()):
+        if not _is_jp_holiday(start_dt.date()):
             return "not_working_hours", "Within working hours (9-19 JST)."
 
         return "valid", "ok"
@@ -161,18 +229,25 @@ Example output (assuming today is 2025-01-27 Monday):
         """Robust JSON extractor — handles raw JSON, ```json blocks, and ``` blocks."""
         text = text.strip()
 
+        # JSON mode replies are bare objects; skip the regex passes when they parse directly.
+        if text.startswith("{"):
+            try:
+                return orjson.loads(text)
+            except orjson.JSONDecodeError:
+                pass
+
         # Strip markdown code fences
-        fence_match = re.search(r"```(?:json)?\s*([\s\S]*?)```", text)
+        fence_match = _FENCE_RE.search(text)
         if fence_match:
             text = fence_match.group(1).strip()
 
         # If there's still no JSON-looking content, try to find the first { ... }
         if not text.startswith("{"):
-            brace_match = re.search(r"\{[\s\S]*\}", text)
+            brace_match = _BRACE_RE.search(text)
             if brace_match:
                 text = brace_match.group(0)
 
-        return json.loads(text)
+        return orjson.loads(text)
 
     def _parse_datetime(self, value) -> Optional[datetime]:
         """
@@ -190,29 +265,32 @@ Example output (assuming today is 2025-01-27 Monday):
         if not value:
             return None
 
-        # Primary expected format
-        for fmt in (
-            "%Y-%m-%d %H:%M:%S",
-            "%Y-%m-%d %H:%M",
-            "%Y-%m-%dT%H:%M:%S",
-            "%Y-%m-%dT%H:%M",
-        ):
+        # Primary expected format via the C ISO 8601 parser; the length guard rejects
+        # date-only values, which must not silently become midnight.
+        if len(value) >= 16:
             try:
-                return datetime.strptime(value, fmt)
+                return ciso8601.parse_datetime(value.replace(" ", "T")).replace(tzinfo=None)
             except ValueError:
-                continue
+                pass
+
+        # Lenient strptime path for what ciso8601 rejects (single-digit fields, doubled spaces).
+        parsed = self._strptime_seconds_optional(value.replace("T", " "))
+        if parsed:
+            return parsed
 
         # Last-ditch: try to extract something datetime-shaped from a messy string
-        match = re.search(r"(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}(?::\d{2})?)", value)
+        match = _DT_RE.search(value)
         if match:
+            return self._strptime_seconds_optional(f"{match.group(1)} {match.group(2)}")
+
+        return None
+
+    def _strptime_seconds_optional(self, value: str) -> Optional[datetime]:
+        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
             try:
-                return datetime.strptime(f"{match.group(1)} {match.group(2)}", "%Y-%m-%d %H:%M:%S")
+                return datetime.strptime(value, fmt)
             except ValueError:
-                try:
-                    return datetime.strptime(f"{match.group(1)} {match.group(2)}", "%Y-%m-%d %H:%M")
-                except ValueError:
-                    pass
-
+                continue
         return None
 
     def _safe_int(self, v, default: int) -> int:
@@ -222,7 +300,13 @@ Example output (assuming today is 2025-01-27 Monday):
             return default
 
     def _is_email(self, value: str) -> bool:
-        return bool(re.match(r"^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$", value))
+        # Cheap string checks reject most malformed values (e.g. "john@") before the regex.
+        if "@" not in value:
+            return False
+        local, _, domain = value.rpartition("@")
+        if not local or "." not in domain:
+            return False
+        return bool(_EMAIL_RE.match(value))
 
 
     def _empty(self, reason: str) -> Dict:
@@ -240,33 +324,21 @@ Example output (assuming today is 2025-01-27 Monday):
     # =========================
     # UPDATE PARSER
     # =========================
-    async def parse_update(self, command: str) -> Dict:
-        now_text = now_jst().strftime("%Y-%m-%d %H:%M:%S")
-
-        system_prompt = f"""You are parsing a meeting update command.
-
-Current datetime (JST / Asia/Tokyo): {now_text}
+    async def parse_update(self, command: str, now: Optional[datetime] = None) -> Dict:
+        now_text = _format_prompt_datetime(now or now_jst())
 
-Extract ONLY the fields that should be updated. Resolve any relative time expressions (e.g. "tomorrow 3pm", "next Monday 10am") into absolute JST datetimes.
-
-Return STRICT JSON ONLY — no markdown, no extra keys. Include only the fields that are changing:
-
-{{
-  "topic": "new title",
-  "start_time": "YYYY-MM-DD HH:MM:SS",
-  "duration": 60,
-  "description": "new description"
-}}"""
+        system_prompt = _UPDATE_SYSTEM_PROMPT.format_map({"now": now_text})
 
         try:
-            completion = self.client.chat.completions.create(
+            completion = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": command},
                 ],
                 temperature=0.1,
-                max_tokens=200,
+                max_tokens=120,
+                response_format={"type": "json_object"},
             )
 
             data = self._load_json(completion.choices[0].message.content)
@@ -280,6 +352,6 @@ Return STRICT JSON ONLY — no markdown, no extra keys. Include only the fields
 
             return data
 
-        except Exception as e:
-            print("Update parse failed:", e)
+        except Exception:
+            logger.exception("Update parse failed")
             return {}
@@ -11,7 +11,7 @@ def to_b64(path: Path) -> str:
 def main():
     parser = argparse.ArgumentParser(description="Encode Google secret files to base64 env vars.")
     parser.add_argument("--creds", default="creds.json", help="Path to Google OAuth client JSON.")
-    parser.add_argument("--token", default="token.pickle", help="Path to Google token pickle.")
+    parser.add_argument("--token", default="token.pickle", help="Path to Google token file (JSON, legacy pickle accepted).")
     args = parser.parse_args()
 
     creds_path = Path(args.creds)
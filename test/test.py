@@ -1,14 +1,14 @@
-import requests
+import asyncio
+import httpx
 import json
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from test_cases import TEST_CASES
 
 BASE_URL = os.getenv("SCHEDULER_BASE_URL", "http://localhost:5000")
 URL = f"{BASE_URL.rstrip('/')}/schedule"
 MAX_WORKERS = int(os.getenv("TEST_WORKERS", "8"))
 
-def run_case(tc):
+async def run_case(client, semaphore, tc):
     payload = {
         "command": tc["command"],
         "history": tc.get("history")
@@ -16,7 +16,8 @@ def run_case(tc):
     expected_statuses = tc.get("expected_statuses", [])
 
     try:
-        r = requests.post(URL, json=payload, timeout=30)
+        async with semaphore:
+            r = await client.post("/schedule", json=payload)
         output = r.json()
         status_code = r.status_code
     except Exception as e:
@@ -38,11 +39,13 @@ def run_case(tc):
         "output": output,
     }
 
-results = []
-with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(TEST_CASES))) as executor:
-    futures = [executor.submit(run_case, tc) for tc in TEST_CASES]
-    for future in as_completed(futures):
-        results.append(future.result())
+async def run_all():
+    # One shared client: every case reuses the same pooled (HTTP/2 where offered) connections.
+    semaphore = asyncio.Semaphore(MAX_WORKERS)
+    async with httpx.AsyncClient(base_url=BASE_URL.rstrip('/'), timeout=30, http2=True) as client:
+        return await asyncio.gather(*(run_case(client, semaphore, tc) for tc in TEST_CASES))
+
+results = list(asyncio.run(run_all()))
 
 results.sort(key=lambda x: x["name"])
 
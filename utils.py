@@ -1,11 +1,28 @@
-from datetime import datetime, time, timedelta, timezone
-from calendar_service import CalendarService
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from cachetools import TTLCache
+import ciso8601
+# Importing utils must not build the service (nlp_parser imports it); resolve it per call.
+from calendar_service import CalendarService, get_calendar_service
 import jpholiday
+import os
+import threading
 
-JST = timezone(timedelta(hours=9))
+JST_OFFSET = timedelta(hours=9)
+JST = timezone(JST_OFFSET)
+FREEBUSY_CACHE_TTL = int(os.getenv("FREEBUSY_CACHE_TTL", "60"))
 
+# Busy intervals keyed by the (window_start, window_end) they were fetched for, in naive UTC.
+_freebusy_cache = TTLCache(maxsize=256, ttl=FREEBUSY_CACHE_TTL)
+_freebusy_cache_lock = threading.Lock()
+# Bumped by clear_busy_cache; a fetch started before a clear must not repopulate the cache.
+_freebusy_generation = 0
 
-calendar_service = CalendarService()
+
+@lru_cache(maxsize=4096)
+def _is_jp_holiday(d: date) -> bool:
+    """jpholiday lookup memoized per date; holidays for a given date never change."""
+    return jpholiday.is_holiday(d)
 
 
 def is_japanese_working_hours(dt: datetime) -> bool:
@@ -13,65 +30,121 @@ def is_japanese_working_hours(dt: datetime) -> bool:
     Check if datetime falls within Japanese working hours (9am-7pm on working days).
     Returns True if it's a working day in Japan AND time is between 9am-7pm.
     """
-    # Check if it's a Japanese holiday
-    if jpholiday.is_holiday(dt.date()):
-        return False
-
+    # Cheapest checks first; the holiday lookup only runs for weekday working-hour slots.
     # Check if it's weekend (Saturday=5, Sunday=6)
     if dt.weekday() >= 5:
         return False
 
     # Check if time is between 9am and 7pm
     meeting_time = dt.time()
-    if time(9, 0) <= meeting_time < time(19, 0):
-        return True
+    if not (time(9, 0) <= meeting_time < time(19, 0)):
+        return False
 
-    return False
+    # Check if it's a Japanese holiday
+    return not _is_jp_holiday(dt.date())
 
 def _to_utc_naive(value: datetime) -> datetime:
+    # JST is a fixed offset, so converting is plain subtraction (no tz transition lookup).
     if value.tzinfo is None:
-        value = value.replace(tzinfo=JST)
-    return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value - JST_OFFSET
+    return (value - value.utcoffset()).replace(tzinfo=None)
 
 
 
 def _parse_google_datetime(value: str | None) -> datetime | None:
     if not value:
         return None
-    normalized = value.replace("Z", "+00:00")
-    return _to_utc_naive(datetime.fromisoformat(normalized))
-
-
+    return _to_utc_naive(ciso8601.parse_datetime(value))
+
+
+
+
+def clear_busy_cache():
+    """Drop cached busy intervals; call after creating, moving or deleting events."""
+    global _freebusy_generation
+    with _freebusy_cache_lock:
+        _freebusy_generation += 1
+        _freebusy_cache.clear()
+
+
+def _busy_intervals(
+    service: CalendarService,
+    window_start: datetime,
+    window_end: datetime
+) -> list[tuple[datetime, datetime]]:
+    with _freebusy_cache_lock:
+        intervals = _freebusy_cache.get((window_start, window_end))
+        if intervals is None:
+            # Any cached window that covers the requested one answers it as well.
+            for (cached_start, cached_end), cached in _freebusy_cache.items():
+                if cached_start <= window_start and window_end <= cached_end:
+                    intervals = cached
+                    break
+        generation = _freebusy_generation
+    if intervals is not None:
+        return intervals
+
+    busy = service.freebusy_query(
+        start_time=window_start.isoformat() + "Z",
+        end_time=window_end.isoformat() + "Z"
+    )
+    intervals = [
+        (_parse_google_datetime(period.get("start")), _parse_google_datetime(period.get("end")))
+        for period in busy
+        if period.get("start") and period.get("end")
+    ]
+    with _freebusy_cache_lock:
+        if generation == _freebusy_generation:
+            _freebusy_cache[(window_start, window_end)] = intervals
+    return intervals
+
+
+def _declined_by_owner(event: dict) -> bool:
+    return any(
+        attendee.get("self") and attendee.get("responseStatus") == "declined"
+        for attendee in event.get("attendees", ())
+    )
 
 
 def has_overlapping_event(
     start_time: datetime,
     duration_minutes: int,
-    exclude_event_id: str | None = None
+    exclude_event_id: str | None = None,
+    service: CalendarService | None = None
 ) -> bool:
+    """
+    Conflict rule (same on both paths, matching Google free/busy): any non-cancelled
+    event shown as busy counts, all-day ones included; events marked "free"
+    (transparency == "transparent") and events the calendar owner declined never count.
+    """
     if duration_minutes <= 0:
         return False
 
+    service = service or get_calendar_service()
+
     start_time_utc = _to_utc_naive(start_time)
     end_time = start_time_utc + timedelta(minutes=duration_minutes)
-    events = calendar_service.get_events(
+
+    if not exclude_event_id:
+        window_start = start_time_utc.replace(second=0, microsecond=0)
+        for busy_start, busy_end in _busy_intervals(service, window_start, end_time):
+            if busy_start < end_time and start_time_utc < busy_end:
+                return True
+        return False
+
+    # Free/busy cannot tell which interval belongs to the event being moved, so list events.
+    # timeMin/timeMax already restrict the listing to events intersecting the window. Use the
+    # API's largest page: skipped items (the moved event, "free" events) must not crowd out a conflict.
+    events = service.get_events(
         start_time=start_time_utc.isoformat() + "Z",
         end_time=end_time.isoformat() + "Z",
-        max_results=50
+        max_results=250
     )
 
-    for existing in events:
-        if existing.get("status") == "cancelled":
-            continue
-        if exclude_event_id and existing.get("id") == exclude_event_id:
-            continue
-
-        existing_start = _parse_google_datetime(existing.get("start", {}).get("dateTime"))
-        existing_end = _parse_google_datetime(existing.get("end", {}).get("dateTime"))
-        if not existing_start or not existing_end:
-            continue
-
-        if existing_start < end_time and start_time_utc < existing_end:
-            return True
-
-    return False
+    return any(
+        existing.get("status") != "cancelled"
+        and existing.get("id") != exclude_event_id
+        and existing.get("transparency") != "transparent"
+        and not _declined_by_owner(existing)
+        for existing in events
+    )